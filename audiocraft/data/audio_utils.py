@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 """Various utilities for audio convertion (pcm format, sample rate and channels),
 and volume normalization."""
+import math
 import sys
 import typing as tp
 
@@ -83,6 +84,86 @@ def normalize_loudness(wav: torch.Tensor, sample_rate: int, loudness_headroom_db
     return output
 
 
+def _k_weighting_biquads(sample_rate: int) -> tp.List[tp.Tuple[tp.List[float], tp.List[float]]]:
+    """(b, a) coefficients of the ITU-R BS.1770 K-weighting filters, as used by
+    `torchaudio.functional.loudness`: a 4 dB treble shelf at 1500 Hz followed by a 38 Hz high-pass.
+    """
+    w0 = 2 * math.pi * 1500.0 / sample_rate
+    alpha = math.sin(w0) / 2 / (1 / math.sqrt(2))
+    A = math.exp(4.0 / 40 * math.log(10))
+    temp1 = 2 * math.sqrt(A) * alpha
+    temp2 = (A - 1) * math.cos(w0)
+    temp3 = (A + 1) * math.cos(w0)
+    treble = ([A * ((A + 1) + temp2 + temp1), -2 * A * ((A - 1) + temp3), A * ((A + 1) + temp2 - temp1)],
+              [(A + 1) - temp2 + temp1, 2 * ((A - 1) - temp3), (A + 1) - temp2 - temp1])
+
+    w0 = 2 * math.pi * 38.0 / sample_rate
+    alpha = math.sin(w0) / 2 / 0.5
+    highpass = ([(1 + math.cos(w0)) / 2, -1 - math.cos(w0), (1 + math.cos(w0)) / 2],
+                [1 + alpha, -2 * math.cos(w0), 1 - alpha])
+    return [treble, highpass]
+
+
+def _k_weighting(wav: torch.Tensor, sample_rate: int) -> torch.Tensor:
+    """Apply K-weighting to a [..., C, T] signal. The biquads are applied in the frequency domain,
+    which runs in parallel over time where an IIR filter would be sequential. The signal is zero padded
+    by one second so that the filters impulse response has decayed before wrapping around.
+    Like `torchaudio.functional.lfilter`, the output of each filter is clamped to [-1, 1].
+    """
+    length = wav.shape[-1]
+    n_fft = length + sample_rate
+    freqs = torch.arange(n_fft // 2 + 1, device=wav.device, dtype=torch.float64) * (2 * math.pi / n_fft)
+    z = torch.exp(-1j * freqs)
+    for b, a in _k_weighting_biquads(sample_rate):
+        response = (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+        spectrum = torch.fft.rfft(wav, n=n_fft) * response.to(torch.complex64)
+        wav = torch.fft.irfft(spectrum, n=n_fft)[..., :length].clamp(-1, 1)
+    return wav
+
+
+def batch_loudness(wav: torch.Tensor, sample_rate: int) -> torch.Tensor:
+    """Loudness in dB LKFS of each item of a [B, C, T] batch, following the ITU-R BS.1770-4
+    recommendation with the same gating as `torchaudio.functional.loudness`, without host syncs.
+    """
+    kernel_size = int(0.4 * sample_rate)
+    stride = int(0.4 * sample_rate * (1 - 0.75))
+    energy = _k_weighting(wav, sample_rate).square().unfold(-1, kernel_size, stride).mean(dim=-1)
+    g = torch.tensor([1.0, 1.0, 1.0, 1.41, 1.41], dtype=wav.dtype, device=wav.device)[:energy.shape[-2]]
+    block_loudness = -0.691 + 10 * torch.log10((g[:, None] * energy).sum(dim=-2))
+
+    # absolute gating then relative gating of the blocks
+    gated = (block_loudness > -70.0).unsqueeze(-2)
+    energy_gated = (gated * energy).sum(dim=-1) / gated.count_nonzero(dim=-1)
+    gamma_rel = -0.691 + 10 * torch.log10((g * energy_gated).sum(dim=-1)) - 10
+    gated = torch.logical_and(gated.squeeze(-2), block_loudness > gamma_rel[:, None]).unsqueeze(-2)
+    energy_gated = (gated * energy).sum(dim=-1) / gated.count_nonzero(dim=-1)
+    return -0.691 + 10 * torch.log10((g * energy_gated).sum(dim=-1))
+
+
+def normalize_loudness_batch(wav: torch.Tensor, sample_rate: int, loudness_headroom_db: float = 14,
+                             loudness_compressor: bool = False, energy_floor: float = 2e-3) -> torch.Tensor:
+    """Batched version of `normalize_loudness`, each item of a [B, C, T] batch gets its own gain.
+    Everything stays on the input device, so it can run on GPU without a sync per item.
+
+    Args:
+        wav (torch.Tensor): Input batch of multichannel audio data.
+        sample_rate (int): Sample rate.
+        loudness_headroom_db (float): Target loudness of the output in dB LUFS.
+        loudness_compressor (bool): Uses tanh for soft clipping.
+        energy_floor (float): anything below that RMS level will not be rescaled.
+    Returns:
+        torch.Tensor: Loudness normalized output data.
+    """
+    assert wav.dim() == 3, wav.shape
+    quiet = wav.pow(2).mean(dim=(-2, -1)).sqrt() < energy_floor
+    delta_loudness = -loudness_headroom_db - batch_loudness(wav, sample_rate)
+    gain = 10.0 ** (delta_loudness / 20.0)
+    output = gain[:, None, None] * wav
+    if loudness_compressor:
+        output = torch.tanh(output)
+    return torch.where(quiet[:, None, None], wav, output)
+
+
 def _clip_wav(wav: torch.Tensor, log_clipping: bool = False, stem_name: tp.Optional[str] = None) -> None:
     """Utility function to clip the audio with logging if specified."""
     max_scale = wav.abs().max()
@@ -376,6 +376,8 @@ class MagnetLMModel(LMModel):
             if condition_tensors:
                 # duplicate input for classifier free guidance
                 sequence = torch.cat([gen_sequence, gen_sequence], dim=0)
+            else:
+                sequence = gen_sequence
 
             all_logits = model(sequence, [], condition_tensors, stage=stage)
 
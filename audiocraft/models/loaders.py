@@ -23,6 +23,7 @@ from pathlib import Path
 from huggingface_hub import hf_hub_download
 import typing as tp
 import os
+import zipfile
 
 from omegaconf import OmegaConf, DictConfig
 import torch
@@ -36,6 +37,13 @@ def get_audiocraft_cache_dir() -> tp.Optional[str]:
     return os.environ.get('AUDIOCRAFT_CACHE_DIR', None)
 
 
+def _load_file(file: str, device='cpu'):
+    # Memory-map the checkpoint so tensors are copied straight from the page cache
+    # when loaded into the model, instead of being staged in a full in-memory copy first.
+    # mmap is only supported for checkpoints saved with the zipfile serialization.
+    return torch.load(file, map_location=device, mmap=zipfile.is_zipfile(file))
+
+
 def _get_state_dict(
     file_or_url_or_id: tp.Union[Path, str],
     filename: tp.Optional[str] = None,
@@ -49,11 +57,11 @@ def _get_state_dict(
     assert isinstance(file_or_url_or_id, str)
 
     if os.path.isfile(file_or_url_or_id):
-        return torch.load(file_or_url_or_id, map_location=device)
+        return _load_file(file_or_url_or_id, device=device)
 
     if os.path.isdir(file_or_url_or_id):
         file = f"{file_or_url_or_id}/{filename}"
-        return torch.load(file, map_location=device)
+        return _load_file(file, device=device)
 
     elif file_or_url_or_id.startswith('https://'):
         return torch.hub.load_state_dict_from_url(file_or_url_or_id, map_location=device, check_hash=True)
@@ -64,7 +72,7 @@ def _get_state_dict(
         file = hf_hub_download(
             repo_id=file_or_url_or_id, filename=filename, cache_dir=cache_dir,
             library_name="audiocraft", library_version=audiocraft.__version__)
-        return torch.load(file, map_location=device)
+        return _load_file(file, device=device)
 
 
 def load_compression_model_ckpt(file_or_url_or_id: tp.Union[Path, str], cache_dir: tp.Optional[str] = None):
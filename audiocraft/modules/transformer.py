@@ -402,10 +402,12 @@ class StreamingMultiheadAttention(StreamingModule):
             if self.memory_efficient:
                 if custom_attn_mask:
                     # When using a custom attn mask:
-                    # Move to query's device, repeat for each sample, remove align8 padding
+                    # Move to query's device, broadcast for each sample, remove align8 padding
+                    # The mask is the same for every sample, expanding avoids materializing
+                    # a [B, H, T, T] copy in every layer at every decoding step.
                     seq_len = query.shape[1]
                     attn_mask = attn_mask.to(q.dtype)
-                    attn_mask = attn_mask.repeat((q.shape[0], 1, 1, 1))
+                    attn_mask = attn_mask.expand(q.shape[0], -1, -1, -1)
                     attn_mask = attn_mask[..., :seq_len, :seq_len]
 
                 p = self.dropout if self.training else 0
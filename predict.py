@@ -1,32 +1,141 @@
 # Prediction interface for Cog ⚙️
 # https://github.com/replicate/cog/blob/main/docs/python.md
-from cog import BasePredictor, Input, Path
+import gc
 import os
+# Must be set before torch initializes CUDA: generation shapes vary with the number of variations.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:128")
+
+from cog import BasePredictor, Input, Path
 import time
 import torch
+import shutil
 import subprocess
+import soundfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from audiocraft.models import MAGNeT
-from audiocraft.data.audio import audio_write
+from audiocraft.data.audio_utils import _clip_wav, i16_pcm, normalize_loudness_batch
 
 AUDIO_CACHE = 'checkpoints'
 AUDIO_URL = "https://weights.replicate.delivery/default/facebookresearch/audiocraft/magnet.tar"
+READY_SENTINEL = '.ready'
+MAX_VARIATIONS = 4
+# Set MAGNET_COMPILE=1 to compile the default model with torch.compile. Off by default until the
+# compiled path has been benchmarked against the eager one on the target GPU.
+COMPILE_DEFAULT_MODEL = os.environ.get("MAGNET_COMPILE", "0") == "1"
+# Models kept in memory at once, each one holds its own LM, T5 encoder and compression model.
+MAX_CACHED_MODELS = 2
+MODEL_CHOICES = [
+    'facebook/magnet-small-10secs',
+    'facebook/magnet-medium-10secs',
+    'facebook/magnet-small-30secs',
+    'facebook/magnet-medium-30secs',
+    'facebook/audio-magnet-small',
+    'facebook/audio-magnet-medium']
+# Maps the `span_score` input onto MAGNeT's `span_arrangement` generation parameter.
+SPAN_ARRANGEMENTS = {
+    'max-nonoverlap': 'nonoverlap',
+    'prod-stride1': 'stride1',
+}
 
 def download_weights(url, dest):
     start = time.time()
     print("downloading url: ", url)
     print("downloading to: ", dest)
-    subprocess.check_call(["pget", "-x", url, dest], close_fds=False)
+    # Remove leftovers of an interrupted download before extracting again.
+    shutil.rmtree(dest, ignore_errors=True)
+    subprocess.check_call(["pget", "-x", "-c", "16", url, dest], close_fds=False)
+    # Only mark the cache as usable once extraction fully succeeded.
+    open(os.path.join(dest, READY_SENTINEL), "w").close()
     print("downloading took: ", time.time() - start)
 
+def write_wav(path: str, wav: torch.Tensor, sample_rate: int) -> Path:
+    """Save an already loudness normalized [C, T] waveform as 16 bit PCM wav.
+    Unlike `audio_write`, this writes in process instead of piping to an ffmpeg subprocess.
+    """
+    # Same checks as `audio_write`: reject non finite output and log any remaining clipping.
+    assert wav.isfinite().all()
+    _clip_wav(wav, log_clipping=True, stem_name=path)
+    soundfile.write(path, i16_pcm(wav).t().numpy(), sample_rate, subtype='PCM_16')
+    return Path(path)
+
 class Predictor(BasePredictor):
     def setup(self) -> None:
         """Load the model into memory to make running multiple predictions efficient"""
         # set the env variable AUDIOCRAFT_CACHE_DIR
         os.environ['AUDIOCRAFT_CACHE_DIR'] = AUDIO_CACHE
-        if not os.path.exists(AUDIO_CACHE):
+        if not os.path.exists(os.path.join(AUDIO_CACHE, READY_SENTINEL)):
             download_weights(AUDIO_URL, AUDIO_CACHE)
-        self.model = MAGNeT.get_pretrained("facebook/audio-magnet-medium")
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.set_float32_matmul_precision("high")
+        # Samples are encoded and written to disk concurrently.
+        self._writer = ThreadPoolExecutor(max_workers=MAX_VARIATIONS)
+        # Recently used models are kept around so that switching between them does not reload checkpoints.
+        self._models: OrderedDict = OrderedDict()
+        self.model = None
+        # Only the default model is loaded ahead of time, and compiled so that compilation
+        # stays out of the request path. The others are loaded eagerly on first request.
+        self.model = self._get_model(MODEL_CHOICES[0], compile=COMPILE_DEFAULT_MODEL)
+
+    def _get_model(self, name: str, compile: bool = False) -> MAGNeT:
+        """Return the pretrained model `name`, loading it on first use and evicting
+        the least recently used model other than the default when the cache is full.
+        Compilation is only requested from `setup`, models loaded by `predict` run eagerly.
+        """
+        if name in self._models:
+            self._models.move_to_end(name)
+        else:
+            self._evict_models(MAX_CACHED_MODELS - 1)
+            model = MAGNeT.get_pretrained(name)
+            if compile:
+                # Dynamo guards on the stage index, the batch size and the sequence length (which depends
+                # on the span arrangement), leave room for every combination so that it doesn't silently
+                # fall back to eager once the default limit is reached.
+                torch._dynamo.config.cache_size_limit = max(
+                    torch._dynamo.config.cache_size_limit,
+                    model.lm.n_q * MAX_VARIATIONS * len(SPAN_ARRANGEMENTS) * 2)
+                # Compile the transformer step and the audio decoder to cut per-step kernel launch overhead.
+                model.lm.forward = torch.compile(model.lm.forward, mode="reduce-overhead", fullgraph=False)
+                model.compression_model.decoder = torch.compile(
+                    model.compression_model.decoder, mode="reduce-overhead", fullgraph=False)
+                self._warmup(model)
+            self._models[name] = model
+        return self._models[name]
+
+    def _evict_models(self, max_models: int) -> None:
+        """Drop least recently used models until at most `max_models` remain, always keeping the default."""
+        while len(self._models) > max_models:
+            name = next((key for key in self._models if key != MODEL_CHOICES[0]), None)
+            if name is None:
+                break
+            evicted = self._models.pop(name)
+            if self.model is evicted:
+                self.model = None
+            del evicted
+            # Modules can sit in reference cycles, collect them so their CUDA memory is actually released.
+            gc.collect()
+            torch.cuda.empty_cache()
+
+    @torch.inference_mode()
+    def _warmup(self, model: MAGNeT) -> None:
+        """Run short generations so that compilation and CUDA graph recording happen outside
+        of the request path. The shapes that vary between requests are the batch size, the
+        sequence length, which is trimmed to a multiple of the span length with the 'nonoverlap'
+        arrangement but not with 'stride1', and the number of T5 tokens of the prompt.
+        Every batch size is warmed up with every span arrangement. CUDA graphs are recorded on
+        the second call of each shape, hence several steps per stage and two generations each.
+        A last generation with a prompt of another length lets dynamo mark the text dimension as
+        dynamic ahead of time, graphs for a new prompt length are still recorded on first use.
+        """
+        for span_arrangement in SPAN_ARRANGEMENTS.values():
+            model.set_generation_params(decoding_steps=[3] * model.lm.n_q, span_arrangement=span_arrangement)
+            for batch_size in range(1, MAX_VARIATIONS + 1):
+                for _ in range(2):
+                    model.generate(["warmup"] * batch_size)
+            model.generate(["warmup with a prompt of a different length"])
+        model.set_generation_params()
 
     @torch.inference_mode()
     def predict(
@@ -37,22 +146,16 @@ class Predictor(BasePredictor):
         ),
         model: str = Input(
             description="Model to use",
-            default="facebook/magnet-small-10secs",
-            choices=[
-                'facebook/magnet-small-10secs',
-                'facebook/magnet-medium-10secs',
-                'facebook/magnet-small-30secs',
-                'facebook/magnet-medium-30secs',
-                'facebook/audio-magnet-small',
-                'facebook/audio-magnet-medium']
+            default=MODEL_CHOICES[0],
+            choices=MODEL_CHOICES,
         ),
         variations: int = Input(
             description="Number of variations to generate",
-            default=3, ge=1, le=4,
+            default=3, ge=1, le=MAX_VARIATIONS,
         ),
         span_score: str = Input(
             default="prod-stride1",
-            choices=["max-nonoverlap", "prod-stride1"],
+            choices=list(SPAN_ARRANGEMENTS),
         ),
         temperature: float = Input(
             default=3.0,
@@ -90,23 +193,34 @@ class Predictor(BasePredictor):
         """Run a single prediction on the model"""
         descriptions = [prompt for _ in range(variations)]
 
-        self.model = MAGNeT.get_pretrained(model)
+        self.model = self._get_model(model)
         self.model.set_generation_params(
             temperature=temperature,
             top_p=top_p,
             max_cfg_coef=max_cfg, min_cfg_coef=min_cfg, 
             decoding_steps=[decoding_steps_stage_1, decoding_steps_stage_2, decoding_steps_stage_3, decoding_steps_stage_4],
-            span_arrangement='stride1' if (span_score == 'prod-stride1') else 'nonoverlap',)
+            span_arrangement=SPAN_ARRANGEMENTS[span_score],)
         wav = self.model.generate(descriptions)
+        # Loudness normalization of the whole batch on the generation device, before the copy to host.
+        wav = normalize_loudness_batch(wav, self.model.sample_rate, loudness_compressor=True)
 
         #Delete older runs
-        os.system("rm -rf /tmp/output")
+        shutil.rmtree("/tmp/output", ignore_errors=True)
+        os.makedirs("/tmp/output", exist_ok=True)
+
+        # Single pinned host buffer for the whole batch: one async D2H copy instead of one sync copy per sample.
+        host_wav = torch.empty(wav.shape, dtype=wav.dtype, pin_memory=wav.is_cuda)
+        host_wav.copy_(wav, non_blocking=True)
+        if wav.is_cuda:
+            torch.cuda.synchronize()
 
-        for idx, one_wav in enumerate(wav):
-            audio_write(f'/tmp/output/{idx}', one_wav.cpu(), self.model.sample_rate, strategy="loudness", loudness_compressor=True)
+        futures = [
+            self._writer.submit(write_wav, f'/tmp/output/{idx}.wav', one_wav, self.model.sample_rate)
+            for idx, one_wav in enumerate(host_wav)]
+        output_paths = [future.result() for future in futures]
 
-        output_paths = []
-        for idx in range(variations):
-            output_paths.append(Path(f'/tmp/output/{idx}.wav'))
+        # Release this request's audio buffers, once per request rather than per sample.
+        del wav, host_wav
+        torch.cuda.empty_cache()
 
         return output_paths
@@ -12,7 +12,9 @@ from audiocraft.data.audio_utils import (
     _clip_wav,
     convert_audio_channels,
     convert_audio,
-    normalize_audio
+    normalize_audio,
+    normalize_loudness,
+    normalize_loudness_batch,
 )
 from ..common_utils import get_batch_white_noise
 
@@ -108,3 +110,14 @@ class TestNormalizeAudio:
         audio = 10.0 * get_batch_white_noise(b, c, int(sr * dur))
         norm_audio = normalize_audio(audio, strategy='peak')
         assert norm_audio.abs().max() <= 1
+
+    def test_normalize_loudness_batch(self):
+        b, c, dur = 3, 1, 2.
+        sr = 16000
+        audio = 0.1 * get_batch_white_noise(b, c, int(sr * dur))
+        audio[1] *= 0.01  # below the energy floor, left untouched
+        norm_audio = normalize_loudness_batch(audio, sr, loudness_compressor=True)
+        assert list(norm_audio.shape) == [b, c, int(sr * dur)]
+        for one_audio, one_norm_audio in zip(audio, norm_audio):
+            expected = normalize_loudness(one_audio, sr, loudness_compressor=True)
+            assert torch.allclose(one_norm_audio, expected, atol=1e-3)
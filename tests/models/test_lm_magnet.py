@@ -0,0 +1,34 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+import torch
+
+from audiocraft.models.lm_magnet import MagnetLMModel
+from audiocraft.modules.codebooks_patterns import ParallelPatternProvider
+from audiocraft.modules.conditioners import ConditionFuser, ConditioningProvider
+
+
+class TestMagnetLMModel:
+    def get_magnet_lm(self):
+        fuser = ConditionFuser(
+            {'cross': [], 'prepend': [], 'sum': [], 'input_interpolate': []})
+        lm = MagnetLMModel(
+            pattern_provider=ParallelPatternProvider(n_q=4),
+            condition_provider=ConditioningProvider({}), fuser=fuser,
+            subcodes_context=-1, compression_model_framerate=24, segment_duration=2, span_len=3,
+            n_q=4, card=400, dim=16, num_heads=4, num_layers=2, custom=True,
+            causal=False, device='cpu', dtype=torch.float32)
+        return lm.eval()
+
+    @pytest.mark.parametrize('span_arrangement', ['nonoverlap', 'stride1'])
+    def test_generate_unconditional(self, span_arrangement):
+        lm = self.get_magnet_lm()
+        codes = lm.generate(num_samples=2, max_gen_len=48, decoding_steps=[2, 2, 2, 2],
+                            span_arrangement=span_arrangement)
+        assert list(codes.shape) == [2, 4, 48]
+        # every masked position has been filled with a sampled token
+        assert (codes < lm.special_token_id).all()